@@ -0,0 +1,514 @@
+# Нагрузочное тестирование бота (синхронный vsuetEG31.py и асинхронный vsuetEG31_async.py режимы).
+# Поднимает локальную заглушку Telegram Bot API (getUpdates, sendMessage, sendPhoto) и сайта рейтинга,
+# запускает бота отдельным процессом и прогоняет реалистичные диалоги для множества виртуальных
+# пользователей. Выводит p50/p95/p99 задержки ответа по шагам, пропускную способность и долю ошибок.
+#
+# Задержка шага — время от появления сообщения пользователя в getUpdates до ожидаемого ответа бота.
+#
+# Запуск: python loadtest.py --users 1000 --ramp 60 --mode async --json results.json
+#         python loadtest.py --startup 5  (холодный старт: время до первого ответа и память)
+import argparse
+import asyncio
+import json
+import math
+import os
+import random
+import socket
+import sys
+import time
+from urllib.parse import parse_qsl
+
+from aiohttp import web
+
+BASE_DIR = os.path.dirname(os.path.abspath(__file__))
+
+# Точки входа бота для каждого режима
+BOT_SCRIPTS = {
+    "sync": "vsuetEG31.py",
+    "async": "vsuetEG31_async.py",
+}
+
+BOT_TOKEN = "123456:LOADTEST"
+FIRST_STUDENT_ID = 100000  # Номера зачётных книжек в заглушке сайта: 100000, 100001, ...
+GROUP_SIZE = 30  # Студентов в одной ведомости
+
+UNKNOWN_STUDENT_ID = "999999"  # Номер, которого нет ни в одной ведомости заглушки
+
+# Шаги диалога: название -> признак ожидаемого ответа бота (метод Bot API, текст или подпись)
+STEP_REPLIES = {
+    "start": lambda method, text: "Привет" in text,
+    "menu": lambda method, text: "Выберите действие" in text,
+    "enter_id": lambda method, text: "Введите номер вашей" in text,
+    "wrong_id": lambda method, text: "ровно 6 цифр" in text,
+    "subscribe": lambda method, text: "Введите номер предмета" in text or "не найден" in text or "не отвечает" in text,
+    "subject": lambda method, text: method == "sendPhoto" or "не найден" in text or "не отвечает" in text,
+    "other_subject": lambda method, text: "Введите номер предмета" in text,
+    "cancel": lambda method, text: "Действие отменено" in text,
+}
+
+# Отказ бота при превышении лимитов ("Слишком много запросов", "Сейчас много запросов"). Учитывается
+# отдельно от обслуженных ответов и не входит в задержки и пропускную способность
+REJECTED_REPLY = lambda method, text: "много запросов" in text
+
+# Доли сценариев среди виртуальных пользователей
+FLOW_WEIGHTS = {
+    "subscribe": 0.6,  # Подключение уведомлений и просмотр нескольких предметов
+    "typo": 0.2,  # Ошибка при вводе номера, затем верный номер
+    "unknown": 0.1,  # Номер, которого нет ни в одной ведомости
+    "browse": 0.1,  # Открыл меню и вышел
+}
+
+
+# 1. ЗАГЛУШКА TELEGRAM BOT API
+
+class FakeTelegram:
+
+    def __init__(self):
+        self.pending_updates = []  # Обновления, ещё не отданные боту через getUpdates
+        self.updates_ready = asyncio.Event()
+        self.polling_started = asyncio.Event()
+        self.next_update_id = 1
+        self.next_message_id = 1
+        self.waiters = {}  # chat_id -> [(признак ответа, future)]
+        self.api_calls = {}  # Метод -> число вызовов
+        self.api_delay = 0
+
+    # 1.1. Сообщение от пользователя (попадёт в следующий ответ getUpdates)
+    def push_message(self, chat_id, text):
+        message = {
+            "message_id": self.next_message_id,
+            "date": int(time.time()),
+            "chat": {"id": chat_id, "type": "private"},
+            "from": {"id": chat_id, "is_bot": False, "first_name": f"user{chat_id}"},
+            "text": text,
+        }
+        if text.startswith("/"):
+            message["entities"] = [{"type": "bot_command", "offset": 0, "length": len(text.split()[0])}]
+
+        self.pending_updates.append({"update_id": self.next_update_id, "message": message})
+        self.next_update_id += 1
+        self.next_message_id += 1
+        self.updates_ready.set()
+
+    # 1.2. Ожидание ответа бота в чат, удовлетворяющего признаку (результат — время, метод и текст ответа)
+    def wait_reply(self, chat_id, predicate):
+        future = asyncio.get_running_loop().create_future()
+        self.waiters.setdefault(chat_id, []).append((predicate, future))
+        return future
+
+    # 1.3. Регистрация исходящего сообщения бота
+    def record_reply(self, method, chat_id, text):
+        now = time.perf_counter()
+        remaining = []
+        for predicate, future in self.waiters.get(chat_id, []):
+            if future.done():
+                continue
+            if predicate(method, text):
+                future.set_result((now, method, text))
+            else:
+                remaining.append((predicate, future))
+        self.waiters[chat_id] = remaining
+
+    # 1.4. Обработчик всех методов Bot API
+    async def handle(self, request):
+        method = request.match_info["method"]
+        self.api_calls[method] = self.api_calls.get(method, 0) + 1
+
+        # TeleBot передаёт параметры в строке запроса, AsyncTeleBot — в теле (в том числе у GET-запросов)
+        params = dict(request.query)
+        if request.content_type == "multipart/form-data":
+            form = await request.post()
+            params.update({key: value for key, value in form.items() if isinstance(value, str)})
+        elif request.can_read_body:
+            params.update(parse_qsl(await request.text()))
+
+        if method == "getUpdates":
+            return self.ok(await self.get_updates(float(params.get("timeout", 0))))
+
+        if method == "getMe":
+            return self.ok({"id": 1, "is_bot": True, "first_name": "LoadTest", "username": "loadtest_bot"})
+
+        if method in ("sendMessage", "sendPhoto"):
+            # Имитация задержки ответа серверов Telegram
+            if self.api_delay:
+                await asyncio.sleep(self.api_delay)
+
+            chat_id = int(params["chat_id"])
+            text = params.get("text") or params.get("caption") or ""
+            self.record_reply(method, chat_id, text)
+
+            message = {
+                "message_id": self.next_message_id,
+                "date": int(time.time()),
+                "chat": {"id": chat_id, "type": "private"},
+            }
+            self.next_message_id += 1
+            if method == "sendMessage":
+                message["text"] = text
+            else:
+                message["caption"] = text
+                message["photo"] = [{"file_id": "photo", "file_unique_id": "photo", "width": 800, "height": 900}]
+            return self.ok(message)
+
+        # deleteWebhook и прочие служебные методы
+        return self.ok(True)
+
+    # 1.5. Long polling: ждём новые обновления не дольше timeout секунд
+    async def get_updates(self, timeout):
+        self.polling_started.set()
+
+        if not self.pending_updates:
+            try:
+                await asyncio.wait_for(self.updates_ready.wait(), timeout=min(timeout, 30))
+            except asyncio.TimeoutError:
+                pass
+
+        updates = self.pending_updates[:100]
+        del self.pending_updates[:100]
+        if not self.pending_updates:
+            self.updates_ready.clear()
+        return updates
+
+    @staticmethod
+    def ok(result):
+        return web.json_response({"ok": True, "result": result})
+
+
+# 2. ЗАГЛУШКА САЙТА РЕЙТИНГА
+
+# 2.1. HTML-таблица ведомости в формате rating.vsuet.ru (31 ячейка в строке)
+def build_rating_page(object_index):
+    rnd = random.Random(object_index)
+    rows = []
+    for i in range(GROUP_SIZE):
+        student_id = str(FIRST_STUDENT_ID + i)
+        cells = [f"<td>{i + 1}</td>", f"<td><a>{student_id}</a></td>", "<td></td>"]
+        cells += [f"<td>{rnd.randint(0, 40)}</td>" for _ in range(28)]
+        rows.append("<tr>" + "".join(cells) + "</tr>")
+    return "<html><body><table>" + "".join(rows) + "</table></body></html>"
+
+
+# 2.2. Обработчик страницы ведомости с настраиваемой задержкой и долей ошибок
+def make_site_handler(site_delay, site_error_rate, site_requests):
+    pages = {}
+
+    async def handle(request):
+        site_requests["total"] += 1
+        object_index = request.query.get("id", "0")
+        if object_index not in pages:
+            pages[object_index] = build_rating_page(object_index)
+
+        # Имитация времени ответа сервера университета
+        await asyncio.sleep(site_delay)
+
+        if random.random() < site_error_rate:
+            site_requests["errors"] += 1
+            return web.Response(status=503, text="Service Unavailable")
+        return web.Response(text=pages[object_index], content_type="text/html")
+
+    return handle
+
+
+# 3. СЦЕНАРИИ ВИРТУАЛЬНЫХ ПОЛЬЗОВАТЕЛЕЙ
+
+SUBJECT_COUNT = 9  # Число предметов в меню бота (DICT_SUBJECT)
+
+# 3.1. Последовательность шагов (название шага, текст сообщения) для сценария
+def build_flow(flow, rnd, student_id):
+    steps = [("start", "/start"), ("menu", "Начать")]
+
+    if flow == "browse":
+        return steps + [("cancel", "Отмена")]
+
+    steps.append(("enter_id", "Ввести номер зачётной книжки"))
+
+    if flow == "unknown":
+        return steps + [("subscribe", UNKNOWN_STUDENT_ID), ("cancel", "Отмена")]
+
+    if flow == "typo":
+        steps.append(("wrong_id", student_id[:-1]))
+
+    steps.append(("subscribe", student_id))
+    for i in range(rnd.randint(1, 3)):
+        if i:
+            steps.append(("other_subject", "Выбрать другой предмет"))
+        steps.append(("subject", str(rnd.randint(1, SUBJECT_COUNT))))
+
+    return steps + [("cancel", "Отмена")]
+
+# 3.2. Один пользователь проходит сценарий; результат — [(шаг, задержка, исход)],
+# исход: "ok" — ожидаемый ответ, "rejected" — отказ по лимиту, "timeout" — ответа не было
+async def run_virtual_user(telegram, chat_id, steps, start_delay, args, rnd):
+    await asyncio.sleep(start_delay)
+
+    samples = []
+    for step, text in steps:
+        expected = STEP_REPLIES[step]
+        reply = telegram.wait_reply(chat_id, lambda method, text: expected(method, text) or REJECTED_REPLY(method, text))
+        sent_at = time.perf_counter()
+        telegram.push_message(chat_id, text)
+        try:
+            replied_at, method, reply_text = await asyncio.wait_for(reply, timeout=args.step_timeout)
+        except asyncio.TimeoutError:
+            # Пользователь не дождался ответа и бросил диалог
+            samples.append((step, None, "timeout"))
+            return samples
+
+        if not expected(method, reply_text):
+            # Получил отказ по лимиту и ушёл
+            samples.append((step, replied_at - sent_at, "rejected"))
+            return samples
+        samples.append((step, replied_at - sent_at, "ok"))
+
+        # Бот сообщил, что сайт не отвечает — дальше по сценарию идти не с чем, пользователь вернётся позже
+        if "не отвечает" in reply_text:
+            return samples
+
+        # Пауза "на подумать" перед следующим сообщением
+        if args.think_time:
+            await asyncio.sleep(rnd.uniform(0, args.think_time))
+
+    return samples
+
+
+# 4. ЗАПУСК БОТА И ПРОГОН НАГРУЗКИ
+
+def get_free_port():
+    with socket.socket() as sock:
+        sock.bind(("127.0.0.1", 0))
+        return sock.getsockname()[1]
+
+# 4.1. Запуск заглушек Bot API и сайта рейтинга на свободном порту
+async def start_stubs(args):
+    telegram = FakeTelegram()
+    telegram.api_delay = args.api_delay
+    site_requests = {"total": 0, "errors": 0}
+
+    app = web.Application()
+    app.router.add_route("*", "/bot{token}/{method}", telegram.handle)
+    app.router.add_get("/ved", make_site_handler(args.site_delay, args.site_error_rate, site_requests))
+
+    port = get_free_port()
+    runner = web.AppRunner(app)
+    await runner.setup()
+    await web.TCPSite(runner, "127.0.0.1", port).start()
+
+    return telegram, site_requests, runner, port
+
+# 4.2. Запуск бота отдельным процессом, направленного на заглушки
+async def spawn_bot(mode, port, args):
+    env = dict(
+        os.environ,
+        BOT_TOKEN=BOT_TOKEN,
+        TELEGRAM_API_URL=f"http://127.0.0.1:{port}/bot{{0}}/{{1}}",
+        RATING_URL=f"http://127.0.0.1:{port}/ved?id={{}}",
+        SITE_OPEN_HOUR="0",  # Заглушка сайта доступна круглосуточно
+        SITE_CLOSE_HOUR="24",
+    )
+    output = None if args.verbose else asyncio.subprocess.DEVNULL
+    return await asyncio.create_subprocess_exec(
+        sys.executable, os.path.join(BASE_DIR, BOT_SCRIPTS[mode]),
+        env=env, cwd=BASE_DIR, stdout=output, stderr=output,
+    )
+
+# 4.3. Остановка бота и заглушек
+async def stop_bot(process, runner):
+    if process.returncode is None:
+        process.terminate()
+        await process.wait()
+    await runner.cleanup()
+
+# 4.4. Прогон нагрузки в одном режиме
+async def run_mode(mode, args):
+    rnd = random.Random(args.seed)
+    telegram, site_requests, runner, port = await start_stubs(args)
+    process = await spawn_bot(mode, port, args)
+
+    flows = list(FLOW_WEIGHTS)
+    weights = list(FLOW_WEIGHTS.values())
+
+    try:
+        await asyncio.wait_for(telegram.polling_started.wait(), timeout=60)
+
+        users = []
+        for i in range(args.users):
+            flow = rnd.choices(flows, weights)[0]
+            student_id = str(FIRST_STUDENT_ID + i % GROUP_SIZE)
+            # Пользователи приходят равномерно в течение --ramp секунд
+            start_delay = args.ramp * i / args.users
+            users.append(run_virtual_user(
+                telegram, 1000 + i, build_flow(flow, rnd, student_id), start_delay, args, random.Random(rnd.random())
+            ))
+
+        started_at = time.perf_counter()
+        users_task = asyncio.ensure_future(asyncio.gather(*users))
+        exit_task = asyncio.ensure_future(process.wait())
+        await asyncio.wait({users_task, exit_task}, return_when=asyncio.FIRST_COMPLETED)
+        elapsed = time.perf_counter() - started_at
+
+        if not users_task.done():
+            users_task.cancel()
+            raise RuntimeError(f"Бот ({mode}) завершился с кодом {process.returncode} во время теста")
+        exit_task.cancel()
+    finally:
+        await stop_bot(process, runner)
+
+    samples = [sample for user_samples in users_task.result() for sample in user_samples]
+    return summarize(mode, samples, elapsed, telegram.api_calls, site_requests)
+
+# 4.5. Резидентная память процесса, МБ (Linux, /proc; None — если недоступно)
+def read_rss_mb(pid):
+    try:
+        with open(f"/proc/{pid}/status") as f:
+            for line in f:
+                if line.startswith("VmRSS:"):
+                    return int(line.split()[1]) / 1024
+    except OSError:
+        pass
+    return None
+
+# 4.6. Холодный старт: время от запуска процесса до ответа на первое сообщение и память после старта
+async def measure_startup(mode, args):
+    telegram, _, runner, port = await start_stubs(args)
+
+    # Сообщение уже ждёт в очереди, как после перезапуска контейнера
+    reply = telegram.wait_reply(1, STEP_REPLIES["start"])
+    telegram.push_message(1, "/start")
+
+    started_at = time.perf_counter()
+    process = await spawn_bot(mode, port, args)
+
+    try:
+        replied_at, _, _ = await asyncio.wait_for(reply, timeout=60)
+        rss_first = read_rss_mb(process.pid)
+
+        # Память после фонового прогрева (PREWARM_DELAY + запас)
+        await asyncio.sleep(3)
+        rss_warm = read_rss_mb(process.pid)
+    finally:
+        await stop_bot(process, runner)
+
+    return {
+        "time_to_first_update": replied_at - started_at,
+        "rss_first_mb": rss_first,
+        "rss_warm_mb": rss_warm,
+    }
+
+
+# 5. ОТЧЁТ
+
+# 5.1. Перцентиль (метод ближайшего ранга)
+def percentile(values, q):
+    ordered = sorted(values)
+    index = max(0, math.ceil(q / 100 * len(ordered)) - 1)
+    return ordered[index]
+
+# 5.2. Статистика задержек для набора замеров (перцентили — только по обслуженным запросам)
+def latency_stats(samples):
+    values = [latency for _, latency, outcome in samples if outcome == "ok"]
+    stats = {
+        "count": len(samples),
+        "served": len(values),
+        "rejected": sum(1 for _, _, outcome in samples if outcome == "rejected"),
+        "errors": sum(1 for _, _, outcome in samples if outcome == "timeout"),
+    }
+    if values:
+        stats.update({
+            "p50": percentile(values, 50),
+            "p95": percentile(values, 95),
+            "p99": percentile(values, 99),
+            "max": max(values),
+        })
+    return stats
+
+# 5.3. Сводка по прогону
+def summarize(mode, samples, elapsed, api_calls, site_requests):
+    overall = latency_stats(samples)
+    steps = {}
+    for step in STEP_REPLIES:
+        step_samples = [sample for sample in samples if sample[0] == step]
+        if step_samples:
+            steps[step] = latency_stats(step_samples)
+
+    return {
+        "mode": mode,
+        "elapsed": elapsed,
+        "throughput": overall["served"] / elapsed if elapsed else 0,
+        "error_rate": overall["errors"] / len(samples) if samples else 0,
+        "rejection_rate": overall["rejected"] / len(samples) if samples else 0,
+        "overall": overall,
+        "steps": steps,
+        "api_calls": api_calls,
+        "site_requests": site_requests,
+    }
+
+# 5.4. Сводка замеров холодного старта (медиана по запускам)
+def print_startup_report(mode, runs):
+    def median(key):
+        values = [run[key] for run in runs if run[key] is not None]
+        return percentile(values, 50) if values else float("nan")
+
+    times = [run["time_to_first_update"] for run in runs]
+    print(f"\nХолодный старт, режим: {mode} (запусков: {len(runs)})")
+    print(f"  До ответа на первое сообщение: медиана {median('time_to_first_update'):.3f} с, "
+          f"мин {min(times):.3f} с, макс {max(times):.3f} с")
+    print(f"  Память (RSS): после первого ответа {median('rss_first_mb'):.1f} МБ, "
+          f"после прогрева {median('rss_warm_mb'):.1f} МБ")
+
+# 5.5. Вывод таблицы результатов
+def print_report(result, users):
+    overall = result["overall"]
+
+    print(f"\nРежим: {result['mode']}")
+    print(f"  Пользователей: {users}, шагов: {overall['count']}, обслужено: {overall['served']}, "
+          f"отказов по лимиту: {overall['rejected']} ({result['rejection_rate']:.1%}), "
+          f"без ответа: {overall['errors']} ({result['error_rate']:.1%})")
+    print(f"  Общее время: {result['elapsed']:.2f} с, "
+          f"пропускная способность: {result['throughput']:.1f} обслуженных ответов/с")
+    print(f"  Вызовы Bot API: {result['api_calls']}")
+    print(f"  Запросы к сайту: {result['site_requests']['total']}, из них с ошибкой: {result['site_requests']['errors']}")
+    print(f"  {'шаг':<14}{'кол-во':>8}{'отказов':>9}{'ошибок':>8}{'p50, с':>9}{'p95, с':>9}{'p99, с':>9}{'макс, с':>9}")
+
+    for step, stats in list(result["steps"].items()) + [("ВСЕГО", overall)]:
+        line = f"  {step:<14}{stats['count']:>8}{stats['rejected']:>9}{stats['errors']:>8}"
+        if "p50" in stats:
+            line += f"{stats['p50']:>9.3f}{stats['p95']:>9.3f}{stats['p99']:>9.3f}{stats['max']:>9.3f}"
+        print(line)
+
+
+async def main():
+    parser = argparse.ArgumentParser(description="Нагрузочное тестирование бота")
+    parser.add_argument("--mode", choices=["sync", "async", "both"], default="both")
+    parser.add_argument("--users", type=int, default=20, help="Число виртуальных пользователей")
+    parser.add_argument("--ramp", type=float, default=0, help="За сколько секунд приходят все пользователи")
+    parser.add_argument("--think-time", type=float, default=0, help="Максимальная пауза между сообщениями, с")
+    parser.add_argument("--site-delay", type=float, default=0.2, help="Задержка ответа заглушки сайта, с")
+    parser.add_argument("--site-error-rate", type=float, default=0, help="Доля ответов сайта с ошибкой 503")
+    parser.add_argument("--api-delay", type=float, default=0, help="Задержка ответа заглушки Bot API, с")
+    parser.add_argument("--step-timeout", type=float, default=300, help="Максимальное ожидание ответа бота, с")
+    parser.add_argument("--seed", type=int, default=1, help="Зерно генератора сценариев")
+    parser.add_argument("--startup", type=int, default=0, metavar="N",
+                        help="Вместо нагрузки замерить холодный старт N раз (время до первого ответа и память)")
+    parser.add_argument("--json", help="Сохранить результаты в JSON-файл (для сравнения прогонов)")
+    parser.add_argument("--verbose", action="store_true", help="Показывать логи бота")
+    args = parser.parse_args()
+
+    modes = ["sync", "async"] if args.mode == "both" else [args.mode]
+    results = []
+    for mode in modes:
+        if args.startup:
+            runs = [await measure_startup(mode, args) for _ in range(args.startup)]
+            print_startup_report(mode, runs)
+            results.append({"mode": mode, "startup": runs})
+        else:
+            result = await run_mode(mode, args)
+            print_report(result, args.users)
+            results.append(result)
+
+    if args.json:
+        with open(args.json, "w", encoding="utf-8") as f:
+            json.dump({"args": vars(args), "results": results}, f, ensure_ascii=False, indent=2)
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
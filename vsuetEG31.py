@@ -1,18 +1,22 @@
 import telebot
 from telebot import types
 from telebot import apihelper  
-from bs4 import BeautifulSoup
-import requests
+import requests  # Уже загружен вместе с telebot
 import os
 import logging
 from io import BytesIO
-from PIL import Image, ImageDraw, ImageFont
+from functools import lru_cache
 import random
+import re
 import threading
 import time
 from datetime import datetime
 from zoneinfo import ZoneInfo
 
+# BeautifulSoup и модули рисования Pillow импортируются при первом использовании (parse_rating_html,
+# create_rating_image) и прогреваются в фоне после первого полученного обновления (prewarm), чтобы
+# не замедлять старт и ответ на первое сообщение
+
 # Настройка часового пояса для функции мониторинга
 moscow_tz = ZoneInfo("Europe/Moscow")
 
@@ -33,7 +37,6 @@ data_lock = threading.Lock()
 BOT_TOKEN = os.environ.get("BOT_TOKEN")
 if not BOT_TOKEN:
     raise ValueError("BOT_TOKEN не установлен! Добавьте его в переменные окружения на Railway.")
-bot = telebot.TeleBot(BOT_TOKEN)
 
 # Константы
 CONFIG = {
@@ -41,9 +44,43 @@ CONFIG = {
     "MIN_TABLE_COLUMNS": 3, # Минимальное количество ячеек в таблице (информативность запроса)
     "CHECK_INTERVAL": 3600, # Интервал между проверками рейтинга в час
     "INACTIVE_DAYS": 120,  # 4 Месяца (примерно 120 дней)
-    "CLEANUP_INTERVAL": 86400  # Проверка раз в сутки (в секундах)
+    "CLEANUP_INTERVAL": 86400,  # Проверка раз в сутки (в секундах)
+    "BREAKER_FAILURE_THRESHOLD": 3,  # Ошибок подряд, после которых сайт считается недоступным
+    "BREAKER_BASE_BACKOFF": 300,  # Первая пауза после отказа сайта (5 минут)
+    "BREAKER_MAX_BACKOFF": 3600,  # Максимальная пауза (удваивается при каждой неудачной пробе)
+    "NEGATIVE_CACHE_TTL": 86400,  # Сколько не проверять номер, не найденный ни в одной ведомости
+    # Адреса можно переопределить через окружение (локальные заглушки для нагрузочного тестирования)
+    "RATING_URL": os.environ.get("RATING_URL", "https://rating.vsuet.ru/web/Ved/Ved.aspx?id={}"),
+    "TELEGRAM_API_URL": os.environ.get("TELEGRAM_API_URL"),  # Формат: http://host/bot{0}/{1}
+    "SITE_OPEN_HOUR": int(os.environ.get("SITE_OPEN_HOUR", 9)),  # Часы работы сайта рейтинга (MSK)
+    "SITE_CLOSE_HOUR": int(os.environ.get("SITE_CLOSE_HOUR", 19)),
+    "DIGEST_MODE": True,  # Объединять изменения по всем предметам в одно сообщение
+    # Сколько секунд копить изменения (0 — одно сообщение за проверку пользователя). Между циклами
+    # поток мониторинга просыпается к окончанию окна, во время цикла сводки проверяются после каждого предмета
+    "DIGEST_WINDOW": 0,
+    "MESSAGE_MAX_LENGTH": 4096,  # Ограничение Telegram на длину сообщения
+    "PREWARM_DELAY": 1,  # Через сколько секунд после первого обновления прогревать BeautifulSoup и Pillow
+    # Запросов рейтинга подряд от одного чата без ожидания. Ввод номера стоит по запросу за каждую
+    # загружаемую ведомость, поэтому значение не меньше числа предметов
+    "RATE_LIMIT_BURST": 12,
+    "RATE_LIMIT_REFILL": 0.2,  # Скорость восстановления лимита (запросов в секунду — 1 раз в 5 секунд)
+    "MAX_LIVE_REQUESTS": 4,  # Одновременных загрузок с сайта и отрисовок картинки для всех чатов
+    "LIVE_REQUEST_WAIT": 5,  # Сколько секунд ждать свободного слота, прежде чем ответить "много запросов"
+    # Потоков обработки сообщений в синхронном режиме. Больше MAX_LIVE_REQUESTS, чтобы общий лимит
+    # действительно ограничивал загрузки, а свободные потоки отвечали на лёгкие сообщения
+    "BOT_THREADS": 8,
+    "RESULT_CACHE_TTL": 300,  # Сколько секунд отвечать на одинаковый запрос последним результатом
+    "RESULT_CACHE_SIZE": 1000,  # После этого числа записей устаревшие результаты удаляются
 }
 
+bot = telebot.TeleBot(BOT_TOKEN, num_threads=CONFIG["BOT_THREADS"])
+
+# Ограничение одновременных "живых" запросов к сайту и отрисовок (общее для всех чатов)
+live_requests = threading.BoundedSemaphore(CONFIG["MAX_LIVE_REQUESTS"])
+
+if CONFIG["TELEGRAM_API_URL"]:
+    apihelper.API_URL = CONFIG["TELEGRAM_API_URL"]
+
 # Словарь предметов и их id на сайте для формирования url на таблицу с рейтингов
 DICT_SUBJECT = {
     "Администрирование отеля": "251282",
@@ -72,6 +109,19 @@ user_subscriptions = {} # Словарь, хранящий пользовате
 previous_ratings = {} # Предыдущее состояние рейтинга для того, чтобы бот не спамил предыдущими изменениями
 user_last_activity = {}  # Словарь для отслеживания активности пользователя
 last_error_time = {}  # Отслеживание ошибок (анти-спам логов)
+pending_digests = {}  # Накопленные изменения для сводки: chat_id -> {"since": время, "items": {предмет: {поле: изменение}}}
+rate_buckets = {}  # Лимит запросов (token bucket): chat_id -> {"tokens", "updated", "notified"}
+recent_results = {}  # Последние результаты: (номер, предмет) -> {"time", "data", "image" (None — ещё не отрисована)}
+unknown_students = {}  # Номера, не найденные ни в одной ведомости: номер -> время проверки
+prewarm_started = threading.Event()  # Прогрев запускается один раз
+
+# Состояние "предохранителя" сайта рейтинга (circuit breaker)
+site_health = {
+    "failures": 0,  # Ошибок подряд
+    "open_until": 0,  # До какого времени запросы к сайту не выполняются
+    "backoff": CONFIG["BREAKER_BASE_BACKOFF"],  # Текущая длительность паузы
+    "probing": False,  # Выполняется ли пробный запрос после паузы
+}
 
 # 1. ФУНКЦИИ ДЛЯ РАБОТЫ С АКТИВНОСТЬЮ ПОЛЬЗОВАТЕЛЕЙ
 
@@ -107,11 +157,15 @@ def cleanup_inactive_users():
                     user_state.pop(chat_id, None)
                     user_selected_data.pop(chat_id, None)
                     user_last_activity.pop(chat_id, None)
+                    pending_digests.pop(chat_id, None)
                     
                     logger.info(f"Очищены данные неактивного пользователя {chat_id} (неактивен более {CONFIG['INACTIVE_DAYS']} дней)")
             
             if users_to_delete:
                 logger.info(f"Очистка завершена. Удалено пользователей: {len(users_to_delete)}")
+
+            # Лимиты запросов удаляются только по давности (не при отмене), иначе "Отмена" обнуляла бы лимит
+            prune_rate_buckets()
             
             # Проверка раз в сутки
             time.sleep(CONFIG["CLEANUP_INTERVAL"])
@@ -143,8 +197,39 @@ def cleanup_on_exit(chat_id):
         user_state.pop(chat_id, None)
         user_selected_data.pop(chat_id, None)
         user_last_activity.pop(chat_id, None)
+        pending_digests.pop(chat_id, None)
     logger.info(f"Данные пользователя {chat_id} очищены при выходе")
 
+# 1.5. Подписка пользователя на уведомления по всем предметам
+def subscribe_user(chat_id, student_id):
+
+    all_subjects = list(DICT_SUBJECT.keys())
+
+    with data_lock:
+        user_selected_data[chat_id] = {"student_id": student_id}
+        user_subscriptions[chat_id] = {
+            "student_id": student_id,
+            "subjects": all_subjects
+        }
+        user_last_activity[chat_id] = time.time()
+
+    return all_subjects
+
+# 1.6. Отмена подписки, если номер не нашёлся ни в одной ведомости
+def unsubscribe_user(chat_id):
+
+    with data_lock:
+        user_subscriptions.pop(chat_id, None)
+        user_selected_data.pop(chat_id, None)
+
+# 1.7. Сохранение последнего известного рейтинга по предмету
+def save_previous_rating(chat_id, subject_name, data):
+
+    with data_lock:
+        if chat_id not in previous_ratings:
+            previous_ratings[chat_id] = {}
+        previous_ratings[chat_id][subject_name] = data
+
 # 2. ВСПОМОГАТЕЛЬНЫЕ ФУНКЦИИ
 
 # 2.1. Получение значений из ячеек таблицы
@@ -196,7 +281,8 @@ def parse_student_row(soup, student_id):
         "Оценка": safe_get_cell(cells, 30),
     }
 
-# 2.3 Создание клавиатуры с номерами предметов для облегченного выбора
+# 2.3 Создание клавиатуры с номерами предметов для облегченного выбора (строится один раз)
+@lru_cache(maxsize=None)
 def create_subject_keyboard():
     
     markup = types.ReplyKeyboardMarkup(resize_keyboard=True)
@@ -215,7 +301,8 @@ def create_subject_keyboard():
     
     return markup
 
-# 2.4 Для создания списка выбора предметов
+# 2.4 Для создания списка выбора предметов (строится один раз)
+@lru_cache(maxsize=None)
 def create_subject_menu_text():
 
     menu_text = "Введите номер предмета:\n\n"
@@ -227,8 +314,33 @@ def create_subject_menu_text():
     
     return menu_text
 
+# 2.4.1. Загрузка шрифтов для изображения (с диска читаются один раз)
+@lru_cache(maxsize=None)
+def get_rating_fonts():
+    from PIL import ImageFont
+
+    base_dir = os.path.dirname(os.path.abspath(__file__))
+    fonts_dir = os.path.join(base_dir, "fonts")
+
+    regular_path = os.path.join(fonts_dir, "DejaVuSans.ttf")
+    bold_path = os.path.join(fonts_dir, "DejaVuSans-Bold.ttf")
+
+    if not os.path.exists(regular_path) or not os.path.exists(bold_path):
+        raise RuntimeError(
+            "Шрифты не найдены в репозитории"
+        )
+
+    # Размеры шрифтов
+    return {
+        "title": ImageFont.truetype(bold_path, 32),
+        "header": ImageFont.truetype(bold_path, 22),
+        "text": ImageFont.truetype(regular_path, 18),
+        "small": ImageFont.truetype(regular_path, 14),
+    }
+
 # 2.5 Создание изображения с рейтингом студентов (с поддержкой кириллицы)
 def create_rating_image(data, student_id, subject_name):
+    from PIL import Image, ImageDraw
 
     # Настройка размеров изображения
     width = 800
@@ -241,23 +353,12 @@ def create_rating_image(data, student_id, subject_name):
     img = Image.new("RGB", (width, height), "#FFFFFF")
     draw = ImageDraw.Draw(img)
 
-    # Загрузка шрифтов
-    base_dir = os.path.dirname(os.path.abspath(__file__))
-    fonts_dir = os.path.join(base_dir, "fonts")
-
-    regular_path = os.path.join(fonts_dir, "DejaVuSans.ttf")
-    bold_path = os.path.join(fonts_dir, "DejaVuSans-Bold.ttf")
-
-    if not os.path.exists(regular_path) or not os.path.exists(bold_path):
-        raise RuntimeError(
-            "Шрифты не найдены в репозитории"
-        )
-
-    # Размеры шрифтов
-    title_font = ImageFont.truetype(bold_path, 32)
-    header_font = ImageFont.truetype(bold_path, 22)
-    text_font = ImageFont.truetype(regular_path, 18)
-    small_font = ImageFont.truetype(regular_path, 14)
+    # Шрифты
+    fonts = get_rating_fonts()
+    title_font = fonts["title"]
+    header_font = fonts["header"]
+    text_font = fonts["text"]
+    small_font = fonts["small"]
 
     # Формирование заголовка
     draw.text((margin, 20), "Рейтинг студента", fill="#2E86C1", font=title_font)
@@ -347,11 +448,15 @@ def create_rating_image(data, student_id, subject_name):
 
     return buffer
 
-# 2.6.мФормирование ссылки и получение рейтинга студента
-def fetch_rating_from_site(object_index, student_id):
-    
-    url = f"https://rating.vsuet.ru/web/Ved/Ved.aspx?id={object_index}"
-    
+# 2.6. Загрузка HTML-кода ведомости по предмету (None — сайт не ответил или отдал страницу без студентов)
+def fetch_subject_page(object_index):
+
+    # Пока "предохранитель" разомкнут, на сайт не ходим
+    if not site_request_allowed():
+        return None
+
+    url = CONFIG["RATING_URL"].format(object_index)
+
     # Выбор случайного User-Agent
     try:
         response = requests.get(
@@ -360,16 +465,43 @@ def fetch_rating_from_site(object_index, student_id):
             timeout=15 # Ожидание в 15 секунд для загрузки всего HTML-кода
         )
         response.raise_for_status()
-        soup = BeautifulSoup(response.text, "html.parser")
-        # Парсинг данных и получение словаря значений
-        data = parse_student_row(soup, student_id)
-        
-        return data
-    
     except Exception as e:
         logger.error(f"Ошибка: {e}")
+        record_site_failure()
         return None
 
+    record_site_success()
+
+    if not page_has_student_rows(response.text):
+        logger.warning(f"Ведомость {object_index} загружена без строк студентов — загрузка считается неудачной")
+        return None
+
+    return response.text
+
+# 2.6.0. Есть ли в HTML-коде хотя бы одна ячейка с номером зачётной книжки. Страница ошибки ASP.NET,
+# заглушка техработ или ещё не заполненная ведомость отдаются с кодом 200, но студентов в них нет
+def page_has_student_rows(html):
+
+    pattern = r">\s*\d{%d}\s*<" % CONFIG["STUDENT_ID_LENGTH"]
+    return re.search(pattern, html) is not None
+
+# 2.6.1. Парсинг рейтинга студента из HTML-кода ведомости
+def parse_rating_html(html, student_id):
+    from bs4 import BeautifulSoup
+
+    soup = BeautifulSoup(html, "html.parser")
+    return parse_student_row(soup, student_id)
+
+# 2.6.2. Формирование ссылки и получение рейтинга студента
+def fetch_rating_from_site(object_index, student_id):
+
+    html = fetch_subject_page(object_index)
+    if html is None:
+        return None
+
+    # Парсинг данных и получение словаря значений
+    return parse_rating_html(html, student_id)
+
 # 2.7. Создание кнопки "Отмена"
 def create_cancel_markup():
     markup = types.ReplyKeyboardMarkup(resize_keyboard=True, one_time_keyboard=False)
@@ -383,10 +515,177 @@ def create_main_menu_markup():
     markup.add("Отмена")
     return markup
 
+# 2.8.1. Кнопки после показа рейтинга (или сообщения о недоступности сайта)
+def create_retry_markup():
+    markup = types.ReplyKeyboardMarkup(resize_keyboard=True, one_time_keyboard=False)
+    markup.row("Выбрать другой предмет", "Отмена")
+    return markup
+
 # 2.9 Функция для проверки времени
 def is_site_available():
     now = datetime.now(moscow_tz).hour
-    return 9 <= now < 19
+    return CONFIG["SITE_OPEN_HOUR"] <= now < CONFIG["SITE_CLOSE_HOUR"]
+
+# 2.10. Разрешён ли запрос к сайту. После паузы пропускается ровно один пробный запрос
+def site_request_allowed():
+
+    with data_lock:
+        if not site_health["open_until"]:
+            return True
+        if time.time() < site_health["open_until"] or site_health["probing"]:
+            return False
+        site_health["probing"] = True
+
+    logger.info("Пауза истекла — пробный запрос к сайту рейтинга")
+    return True
+
+# 2.11. Сайт ответил — "предохранитель" замыкается
+def record_site_success():
+
+    with data_lock:
+        was_open = bool(site_health["open_until"])
+        site_health["failures"] = 0
+        site_health["open_until"] = 0
+        site_health["backoff"] = CONFIG["BREAKER_BASE_BACKOFF"]
+        site_health["probing"] = False
+
+    if was_open:
+        logger.info("Сайт рейтинга снова отвечает — запросы возобновлены")
+
+# 2.12. Сайт не ответил. После нескольких ошибок подряд (или неудачной пробы) запросы ставятся на паузу
+def record_site_failure():
+
+    with data_lock:
+        site_health["failures"] += 1
+
+        if site_health["probing"]:
+            # Проба не удалась — увеличиваем паузу
+            site_health["probing"] = False
+            site_health["backoff"] = min(site_health["backoff"] * 2, CONFIG["BREAKER_MAX_BACKOFF"])
+        elif site_health["open_until"] or site_health["failures"] < CONFIG["BREAKER_FAILURE_THRESHOLD"]:
+            return
+
+        backoff = site_health["backoff"]
+        site_health["open_until"] = time.time() + backoff
+
+    logger.warning(f"Сайт рейтинга не отвечает — запросы приостановлены на {backoff} секунд")
+
+# 2.13. Разомкнут ли "предохранитель" (сайт считается недоступным до успешной пробы)
+def is_site_down():
+
+    with data_lock:
+        return bool(site_health["open_until"])
+
+# 2.13.1. Сколько секунд осталось до пробного запроса (0 — пробу можно выполнять)
+def site_pause_remaining():
+
+    with data_lock:
+        if not site_health["open_until"]:
+            return 0
+        return max(0, site_health["open_until"] - time.time())
+
+# 2.14. Номер зачётной книжки недавно не нашёлся ни в одной ведомости
+def is_unknown_student(student_id):
+
+    with data_lock:
+        checked_at = unknown_students.get(student_id)
+        if checked_at is None:
+            return False
+        if time.time() - checked_at > CONFIG["NEGATIVE_CACHE_TTL"]:
+            unknown_students.pop(student_id, None)
+            return False
+        return True
+
+# 2.15. Запоминание (или сброс) номера, которого нет ни в одной ведомости
+def mark_unknown_student(student_id, unknown=True):
+
+    with data_lock:
+        if unknown:
+            unknown_students[student_id] = time.time()
+        else:
+            unknown_students.pop(student_id, None)
+
+
+# 2.16. Сообщение о номере, которого нет ни в одной ведомости (состояние ввода номера сохраняется)
+def send_unknown_student_message(chat_id, student_id):
+
+    try:
+        bot.send_message(
+            chat_id,
+            f"Студент {student_id} не найден ни в одной ведомости.\n"
+            "Проверьте номер зачётной книжки и повторите ввод:",
+            reply_markup=create_cancel_markup()
+        )
+    except Exception as e:
+        logger.error(f"Ошибка отправки сообщения: {e}")
+
+# 2.17. Лимит запросов чата (token bucket): cost — сколько запросов списать.
+# Возвращает (разрешено, нужно ли предупредить пользователя)
+def take_request_token(chat_id, cost=1):
+
+    now = time.time()
+
+    with data_lock:
+        bucket = rate_buckets.setdefault(
+            chat_id, {"tokens": CONFIG["RATE_LIMIT_BURST"], "updated": now, "notified": False}
+        )
+        bucket["tokens"] = min(
+            CONFIG["RATE_LIMIT_BURST"],
+            bucket["tokens"] + (now - bucket["updated"]) * CONFIG["RATE_LIMIT_REFILL"]
+        )
+        bucket["updated"] = now
+
+        if bucket["tokens"] >= cost:
+            bucket["tokens"] -= cost
+            bucket["notified"] = False
+            return True, False
+
+        # Предупреждаем один раз, остальные сообщения до восстановления лимита молча пропускаем
+        notify = not bucket["notified"]
+        bucket["notified"] = True
+        return False, notify
+
+# 2.17.1. Удаление лимитов, которые давно не использовались (такой лимит уже полностью восстановлен)
+def prune_rate_buckets():
+
+    full_refill_time = CONFIG["RATE_LIMIT_BURST"] / CONFIG["RATE_LIMIT_REFILL"]
+    now = time.time()
+
+    with data_lock:
+        for chat_id, bucket in list(rate_buckets.items()):
+            if now - bucket["updated"] > full_refill_time:
+                del rate_buckets[chat_id]
+
+# 2.18. Недавний результат того же запроса (None — нужно загружать заново)
+def get_recent_result(student_id, subject_name):
+
+    with data_lock:
+        result = recent_results.get((student_id, subject_name))
+        if result and time.time() - result["time"] <= CONFIG["RESULT_CACHE_TTL"]:
+            return result
+    return None
+
+# 2.19. Сохранение результата: данные рейтинга (None, если студент не найден) и PNG-картинка
+# (None — не отрисована: при подключении уведомлений ведомости загружаются без картинок)
+def store_recent_result(student_id, subject_name, data, image=None):
+
+    now = time.time()
+    result = {"time": now, "data": data, "image": image.getvalue() if image else None}
+
+    with data_lock:
+        if len(recent_results) >= CONFIG["RESULT_CACHE_SIZE"]:
+            for key, old in list(recent_results.items()):
+                if now - old["time"] > CONFIG["RESULT_CACHE_TTL"]:
+                    del recent_results[key]
+        recent_results[(student_id, subject_name)] = result
+
+    return result
+
+# 2.20. Сколько ведомостей придётся загрузить с сайта при вводе номера (не меньше одной)
+def count_pages_to_load(student_id):
+
+    missing = sum(1 for subject_name in DICT_SUBJECT if get_recent_result(student_id, subject_name) is None)
+    return max(missing, 1)
 
 
 # 3. ФУНКЦИИ МОНИТОРИНГА
@@ -397,11 +696,7 @@ def send_change_notification(chat_id, subject_name, student_id, changes):
     message = f"Изменён рейтинг по предмету: {subject_name} \n\n"
     message += f"Время: {datetime.now(moscow_tz).strftime('%d.%m.%Y %H:%M')}\n\n"
     message += f"Изменения:\n\n"
-    
-    for change in changes:
-        message += f"{change['field']}:\n"
-        message += f"Было: {change['old']}\n"
-        message += f"Стало: {change['new']}\n\n"
+    message += format_changes(changes)
     
     try:
         bot.send_message(chat_id, message)
@@ -409,6 +704,132 @@ def send_change_notification(chat_id, subject_name, student_id, changes):
         update_activity(chat_id)  # Обновляем активность при отправке уведомления
     except Exception as e:
         logger.error(f"Ошибка отправки уведомления: {e}")
+
+# 3.1.1. Текст списка изменений по одному предмету
+def format_changes(changes):
+
+    text = ""
+    for change in changes:
+        text += f"{change['field']}:\n"
+        text += f"Было: {change['old']}\n"
+        text += f"Стало: {change['new']}\n\n"
+    return text
+
+# 3.1.2. Добавление изменений по предмету в сводку пользователя (режим DIGEST_MODE).
+# Если предмет менялся в нескольких циклах, по каждому полю остаётся первое "Было" и последнее "Стало"
+def queue_change_digest(chat_id, subject_name, changes):
+
+    with data_lock:
+        digest = pending_digests.setdefault(chat_id, {"since": time.time(), "items": {}})
+        fields = digest["items"].setdefault(subject_name, {})
+
+        for change in changes:
+            if change["field"] in fields:
+                fields[change["field"]]["new"] = change["new"]
+            else:
+                fields[change["field"]] = dict(change)
+
+            # Значение вернулось к исходному — изменения нет
+            if fields[change["field"]]["old"] == fields[change["field"]]["new"]:
+                del fields[change["field"]]
+
+        if not fields:
+            del digest["items"][subject_name]
+
+# 3.1.3. Разбиение сводки на сообщения не длиннее MESSAGE_MAX_LENGTH (по границам блоков предметов)
+def split_digest_text(header, blocks):
+
+    limit = CONFIG["MESSAGE_MAX_LENGTH"]
+    messages = []
+    current = header
+
+    for block in blocks:
+        if len(current) + len(block) > limit and current != header:
+            messages.append(current.rstrip())
+            current = "(продолжение)\n\n"
+
+        # Блок одного предмета не помещается даже в пустое сообщение — режем по символам
+        while len(current) + len(block) > limit:
+            cut = limit - len(current)
+            messages.append(current + block[:cut])
+            block = block[cut:]
+            current = ""
+
+        current += block
+
+    if current.strip():
+        messages.append(current.rstrip())
+
+    return messages
+
+# 3.1.4. Отправка сводки изменений одним сообщением (или несколькими при превышении длины)
+def send_change_digest(chat_id, items):
+
+    # Один предмет — обычное уведомление
+    if len(items) == 1:
+        subject_name, changes = items[0]
+        send_change_notification(chat_id, subject_name, None, changes)
+        return
+
+    header = f"Изменён рейтинг по предметам: {len(items)}\n\n"
+    header += f"Время: {datetime.now(moscow_tz).strftime('%d.%m.%Y %H:%M')}\n\n"
+
+    blocks = [
+        f"Предмет: {subject_name}\n\n" + format_changes(changes)
+        for subject_name, changes in items
+    ]
+
+    try:
+        for message in split_digest_text(header, blocks):
+            bot.send_message(chat_id, message)
+        logger.info(f"Сводка изменений ({len(items)} предм.) отправлена пользователю {chat_id}")
+        update_activity(chat_id)
+    except Exception as e:
+        logger.error(f"Ошибка отправки уведомления: {e}")
+
+# 3.1.5. Отправка сводок, окно накопления которых истекло
+def flush_change_digests():
+
+    now = time.time()
+
+    with data_lock:
+        ready = [
+            chat_id for chat_id, digest in pending_digests.items()
+            if now - digest["since"] >= CONFIG["DIGEST_WINDOW"]
+        ]
+        digests = [(chat_id, pending_digests.pop(chat_id)["items"]) for chat_id in ready]
+
+    for chat_id, items in digests:
+        if items:
+            send_change_digest(chat_id, [
+                (subject_name, list(fields.values())) for subject_name, fields in items.items()
+            ])
+
+# 3.1.6. Время окончания окна самой старой сводки (None — сводок нет)
+def next_digest_deadline():
+
+    with data_lock:
+        if not pending_digests:
+            return None
+        return min(digest["since"] for digest in pending_digests.values()) + CONFIG["DIGEST_WINDOW"]
+
+# 3.1.7. Пауза между проверками с отправкой сводок по окончании их окна
+def sleep_with_digests(seconds):
+
+    wake_at = time.time() + seconds
+
+    while True:
+        deadline = next_digest_deadline()
+        until = wake_at if deadline is None else min(wake_at, deadline)
+        delay = until - time.time()
+        if delay > 0:
+            time.sleep(delay)
+
+        flush_change_digests()
+
+        if time.time() >= wake_at:
+            return
+
 # 3.1 Для проверки изменений рейтинга всех подписанных на уведомления пользователей
 def check_rating_changes():
     
@@ -435,14 +856,33 @@ def check_rating_changes():
             
             if not student_id or not subjects:
                 continue
-            
+
+            # Номер недавно не нашёлся ни в одной ведомости — не тратим на него запросы
+            if is_unknown_student(student_id):
+                continue
+
+            pages_loaded = 0
+            pages_failed = 0
+            found_count = 0
+
             for subject_name in subjects:
                 if subject_name not in DICT_SUBJECT:
                     continue
                 
                 object_index = DICT_SUBJECT[subject_name]
-                current_data = fetch_rating_from_site(object_index, student_id)
-                
+                html = fetch_subject_page(object_index)
+
+                if html is None and is_site_down():
+                    logger.warning("Проверка прервана: сайт рейтинга не отвечает")
+                    return
+
+                if html is not None:
+                    pages_loaded += 1
+                    current_data = parse_rating_html(html, student_id)
+                else:
+                    pages_failed += 1
+                    current_data = None
+
                 if not current_data:
                     # ЛОГИРОВАНИЕ НЕ ЧАЩЕ 1 РАЗА В ЧАС ВО ИЗБЕЖАНИЯ СПАМА ЛОГОВ
                     last_error = last_error_time.get(chat_id, 0)
@@ -454,7 +894,9 @@ def check_rating_changes():
                         last_error_time[chat_id] = current_time
 
                     continue
-                
+
+                found_count += 1
+
                 with data_lock:
                     prev_data = previous_ratings.get(chat_id, {}).get(subject_name, {})
                 
@@ -479,17 +921,32 @@ def check_rating_changes():
                         })
                 
                 if changes:
-                    send_change_notification(chat_id, subject_name, student_id, changes)
+                    if CONFIG["DIGEST_MODE"]:
+                        queue_change_digest(chat_id, subject_name, changes)
+                    else:
+                        send_change_notification(chat_id, subject_name, student_id, changes)
                 
-                with data_lock: 
-                    if chat_id not in previous_ratings:
-                        previous_ratings[chat_id] = {}
-                    previous_ratings[chat_id][subject_name] = current_data
+                save_previous_rating(chat_id, subject_name, current_data)
+
+                # Сводки с истёкшим окном (в том числе других пользователей) не ждут конца цикла
+                flush_change_digests()
                 
                 time.sleep(45)
+
+            # Все ведомости загрузились, но номера нет ни в одной. Номер, по которому уже есть
+            # сохранённый рейтинг, в кэш не попадает: скорее всего, ведомости временно пусты
+            with data_lock:
+                was_found_before = bool(previous_ratings.get(chat_id))
+
+            if pages_loaded and not pages_failed and not found_count and not was_found_before:
+                mark_unknown_student(student_id)
+                logger.warning(f"Номер {student_id} не найден ни в одной ведомости — проверка отложена")
                 
         except Exception as e:
             logger.error(f"Ошибка проверки для chat_id {chat_id}: {e}")
+
+        # Сводка по пользователю уходит сразу после проверки его предметов (при DIGEST_WINDOW = 0)
+        flush_change_digests()
     
     logger.info("Проверка завершена")
 
@@ -503,8 +960,13 @@ def monitoring_thread():
             
             if has_subscriptions and is_site_available():
                 check_rating_changes()
-            
-            time.sleep(CONFIG["CHECK_INTERVAL"])    
+
+            # Если сайт не отвечает — повторяем проверку сразу после паузы, а не через час.
+            # Сводки, накопленные до прерывания проверки или ждущие окончания окна, уходят во время паузы
+            if is_site_down():
+                sleep_with_digests(max(site_pause_remaining(), 60))
+            else:
+                sleep_with_digests(CONFIG["CHECK_INTERVAL"])
 
         except Exception as e:
             logger.error(f"Ошибка в потоке мониторинга: {e}")
@@ -599,20 +1061,15 @@ def handle_student_id_first(message):
     """Обработчик ввода номера студента"""
     chat_id = message.chat.id
     student_id = message.text.strip()
-
     
     # ПРЕДУПРЕЖДЕНИЕ О НОЧНОМ ВРЕМЕНИ
     if not is_site_available():
         try:
-
-            markup = types.ReplyKeyboardMarkup(resize_keyboard=True, one_time_keyboard=False)
-            markup.row("Выбрать другой предмет", "Отмена")
-
             bot.send_message(
                 chat_id,
                 "Сайт рейтинга недоступен с 19:00 до 09:00.\n"
                 "Попробуйте запросить данные днём.",
-                reply_markup=markup
+                reply_markup=create_retry_markup()
             )
         except Exception as e:
             logger.error(f"Ошибка отправки сообщения: {e}")
@@ -631,17 +1088,24 @@ def handle_student_id_first(message):
         except Exception as e:
             logger.error(f"Ошибка отправки сообщения: {e}")
         return
+
+    # Номер недавно не нашёлся ни в одной ведомости — не загружаем их заново
+    if is_unknown_student(student_id):
+        send_unknown_student_message(chat_id, student_id)
+        return
+
+    # Ограничение частоты запросов: ввод номера стоит столько запросов, сколько ведомостей придётся загрузить
+    allowed, notify = take_request_token(chat_id, cost=count_pages_to_load(student_id))
+    if not allowed:
+        if notify:
+            try:
+                bot.send_message(chat_id, "Слишком много запросов. Подождите несколько секунд и повторите.")
+            except Exception as e:
+                logger.error(f"Ошибка отправки сообщения: {e}")
+        return
     
-    with data_lock:
-        user_selected_data[chat_id] = {"student_id": student_id}
-        
-        all_subjects = list(DICT_SUBJECT.keys())
-        user_subscriptions[chat_id] = {
-            "student_id": student_id, 
-            "subjects": all_subjects
-        }
-        user_last_activity[chat_id] = time.time()
-    
+    all_subjects = subscribe_user(chat_id, student_id)
+
     try:
         bot.send_message(
             chat_id,
@@ -650,18 +1114,72 @@ def handle_student_id_first(message):
         )
     except Exception as e:
         logger.error(f"Ошибка отправки сообщения: {e}")
-    
+
+    pages_loaded = 0
+    pages_failed = 0
+    found_count = 0
+    busy = False
+
     for subject_name in all_subjects:
         object_index = DICT_SUBJECT[subject_name]
-        data = fetch_rating_from_site(object_index, student_id)
-        
+
+        # Ведомость по этому номеру недавно загружалась — повторный ввод не обращается к сайту
+        result = get_recent_result(student_id, subject_name)
+        if result is not None:
+            pages_loaded += 1
+            if result["data"]:
+                found_count += 1
+                save_previous_rating(chat_id, subject_name, result["data"])
+            continue
+
+        # Слот общего лимита занимается только на загрузку и разбор одной ведомости (без паузы между ними)
+        if not live_requests.acquire(timeout=CONFIG["LIVE_REQUEST_WAIT"]):
+            busy = True
+            break
+
+        try:
+            html = fetch_subject_page(object_index)
+            data = parse_rating_html(html, student_id) if html is not None else None
+        finally:
+            live_requests.release()
+
+        if html is None:
+            pages_failed += 1
+            # Сайт не отвечает — остальные ведомости загрузит мониторинг
+            if is_site_down():
+                break
+        else:
+            pages_loaded += 1
+            store_recent_result(student_id, subject_name, data)
+    
         if data:
-            with data_lock:
-                if chat_id not in previous_ratings:
-                    previous_ratings[chat_id] = {}
-                previous_ratings[chat_id][subject_name] = data
-        
+            found_count += 1
+            save_previous_rating(chat_id, subject_name, data)
+    
         time.sleep(1)
+
+    # Ни одна ведомость не загрузилась — без исходного рейтинга подписку не подключаем
+    if not pages_loaded:
+        unsubscribe_user(chat_id)
+        if busy:
+            text = "Сейчас много запросов. Повторите через несколько секунд."
+        else:
+            text = "Сайт рейтинга сейчас не отвечает.\nПопробуйте ввести номер позже:"
+        try:
+            bot.send_message(chat_id, text, reply_markup=create_cancel_markup())
+        except Exception as e:
+            logger.error(f"Ошибка отправки сообщения: {e}")
+        return
+
+    # Все ведомости загрузились, но номера нет ни в одной — уведомления не подключаем
+    if pages_loaded and not pages_failed and not busy and not found_count:
+        mark_unknown_student(student_id)
+        unsubscribe_user(chat_id)
+        send_unknown_student_message(chat_id, student_id)
+        return
+
+    if found_count:
+        mark_unknown_student(student_id, unknown=False)
     
     try:
         bot.send_message(
@@ -696,15 +1214,19 @@ def handle_subject_choice_after_id(message):
 
     logger.info(f"{chat_id} выбрал предмет: {message.text}")
 
+    # Ограничение частоты запросов от одного чата
+    allowed, notify = take_request_token(chat_id)
+    if not allowed:
+        if notify:
+            bot.send_message(chat_id, "Слишком много запросов. Подождите несколько секунд и повторите.")
+        return
+
     # проверка времени
     if not is_site_available():
-        markup = types.ReplyKeyboardMarkup(resize_keyboard=True)
-        markup.row("Выбрать другой предмет", "Отмена")
-
         bot.send_message(
             chat_id,
             "Сайт рейтинга недоступен с 19:00 до 09:00.\nПопробуйте днём.",
-            reply_markup=markup
+            reply_markup=create_retry_markup()
         )
         return
 
@@ -729,19 +1251,48 @@ def handle_subject_choice_after_id(message):
     subject_name = list(DICT_SUBJECT.keys())[choice - 1]
     object_index = DICT_SUBJECT[subject_name]
 
-    bot.send_message(chat_id, "Загружаем данные...")
-
-    data = fetch_rating_from_site(object_index, student_id)
+    markup = create_retry_markup()
 
-    markup = types.ReplyKeyboardMarkup(resize_keyboard=True)
-    markup.row("Выбрать другой предмет", "Отмена")
+    # Тот же запрос недавно уже выполнялся — отвечаем последним результатом
+    result = get_recent_result(student_id, subject_name)
 
-    if data:
-        image = create_rating_image(data, student_id, subject_name)
+    # Нет результата или ведомость загружена при подключении уведомлений, но картинка ещё не отрисована
+    if result is None or (result["data"] and result["image"] is None):
+        # Общее ограничение одновременных загрузок и отрисовок
+        if not live_requests.acquire(timeout=CONFIG["LIVE_REQUEST_WAIT"]):
+            bot.send_message(
+                chat_id,
+                "Сейчас много запросов. Повторите через несколько секунд.",
+                reply_markup=markup
+            )
+            return
 
+        try:
+            if result is None:
+                bot.send_message(chat_id, "Загружаем данные...")
+
+                html = fetch_subject_page(object_index)
+                if html is None:
+                    bot.send_message(
+                        chat_id,
+                        "Сайт рейтинга сейчас не отвечает.\nПопробуйте позже.",
+                        reply_markup=markup
+                    )
+                    return
+
+                data = parse_rating_html(html, student_id)
+            else:
+                data = result["data"]
+
+            image = create_rating_image(data, student_id, subject_name) if data else None
+            result = store_recent_result(student_id, subject_name, data, image)
+        finally:
+            live_requests.release()
+
+    if result["image"]:
         bot.send_photo(
             chat_id,
-            image,
+            BytesIO(result["image"]),
             caption=f"Рейтинг по предмету: {subject_name}",
             reply_markup=markup
         )
@@ -766,10 +1317,9 @@ def handle_choose_again(message):
 
 # 5. ЗАПУСК
 
-if __name__ == "__main__":
-    bot.remove_webhook()
-    logger.info("Веб-хук удален")
-    
+# 5.1. Запуск фоновых потоков (общий для синхронного и асинхронного режимов)
+def start_background_threads():
+
     # Запуск потока мониторинга
     monitoring = threading.Thread(target=monitoring_thread, daemon=True)
     monitoring.start()
@@ -779,6 +1329,47 @@ if __name__ == "__main__":
     cleanup = threading.Thread(target=cleanup_inactive_users, daemon=True)
     cleanup.start()
     logger.info(f"Поток очистки запущен (неактивность более {CONFIG['INACTIVE_DAYS']} дней / 4 месяца)")
+
+# 5.2. Прогрев тяжёлых зависимостей, шрифтов и меню. Пауза даёт ответить на первое сообщение без конкуренции
+def prewarm():
+
+    time.sleep(CONFIG["PREWARM_DELAY"])
+    started = time.perf_counter()
+
+    try:
+        import bs4  # noqa: F401
+        from PIL import Image, ImageDraw  # noqa: F401
+        get_rating_fonts()
+        create_subject_menu_text()
+        create_subject_keyboard()
+    except Exception as e:
+        logger.error(f"Ошибка прогрева: {e}")
+        return
+
+    logger.info(f"Прогрев завершён за {(time.perf_counter() - started) * 1000:.0f} мс")
+
+# 5.3. Запуск прогрева в фоне (один раз, при первом полученном обновлении)
+def start_prewarm():
+
+    with data_lock:
+        if prewarm_started.is_set():
+            return
+        prewarm_started.set()
+
+    threading.Thread(target=prewarm, daemon=True).start()
+
+# 5.4. Слушатель обновлений: первый успешный getUpdates с сообщениями запускает прогрев
+def prewarm_on_first_update(messages):
+
+    if not prewarm_started.is_set():
+        start_prewarm()
+
+
+if __name__ == "__main__":
+    bot.remove_webhook()
+    logger.info("Веб-хук удален")
+    
+    start_background_threads()
     
     # Информация о старте
     logger.info("=" * 50)
@@ -787,6 +1378,8 @@ if __name__ == "__main__":
     logger.info(f"Очистка неактивных: {CONFIG['INACTIVE_DAYS']} дней (4 месяца)")
     logger.info("=" * 50)
     
+    bot.set_update_listener(prewarm_on_first_update)
+
     try:
         bot.infinity_polling(timeout=30, long_polling_timeout=30)
     except KeyboardInterrupt:
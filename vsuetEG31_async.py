@@ -0,0 +1,462 @@
+# Асинхронный режим бота: те же состояния диалога, мониторинг и парсинг, что и в vsuetEG31.py,
+# но обработчики работают на asyncio (AsyncTeleBot + aiohttp) и не занимают поток на время ожидания
+# ответа сайта рейтинга или Telegram. Парсинг HTML и отрисовка картинки выполняются в пуле потоков.
+#
+# Запуск: python vsuetEG31_async.py (переменные окружения те же, что и у vsuetEG31.py)
+import asyncio
+import random
+from io import BytesIO
+
+import aiohttp
+from telebot import types
+from telebot import asyncio_helper
+from telebot.async_telebot import AsyncTeleBot
+
+from vsuetEG31 import (
+    BOT_TOKEN,
+    CONFIG,
+    DICT_SUBJECT,
+    USER_AGENTS,
+    data_lock,
+    logger,
+    user_state,
+    user_selected_data,
+    update_activity,
+    cleanup_on_exit,
+    subscribe_user,
+    unsubscribe_user,
+    save_previous_rating,
+    parse_rating_html,
+    page_has_student_rows,
+    create_rating_image,
+    create_subject_keyboard,
+    create_subject_menu_text,
+    create_cancel_markup,
+    create_main_menu_markup,
+    create_retry_markup,
+    is_site_available,
+    is_site_down,
+    site_request_allowed,
+    record_site_success,
+    record_site_failure,
+    is_unknown_student,
+    mark_unknown_student,
+    start_background_threads,
+    prewarm_started,
+    start_prewarm,
+    live_requests,
+    take_request_token,
+    get_recent_result,
+    store_recent_result,
+    count_pages_to_load,
+)
+
+if CONFIG["TELEGRAM_API_URL"]:
+    asyncio_helper.API_URL = CONFIG["TELEGRAM_API_URL"]
+
+bot = AsyncTeleBot(BOT_TOKEN)
+
+# Сессия aiohttp для запросов к сайту рейтинга (создаётся внутри работающего цикла событий)
+site_session = None
+
+
+# 1. АСИНХРОННЫЙ КЛИЕНТ САЙТА РЕЙТИНГА
+
+# 1.1. Получение (или создание) общей сессии
+async def get_site_session():
+    global site_session
+
+    if site_session is None or site_session.closed:
+        site_session = aiohttp.ClientSession(timeout=aiohttp.ClientTimeout(total=15))
+    return site_session
+
+# 1.2. Выполнение блокирующей (CPU) функции в пуле потоков, чтобы не останавливать цикл событий
+async def run_blocking(func, *args):
+    loop = asyncio.get_running_loop()
+    return await loop.run_in_executor(None, func, *args)
+
+# 1.3. Загрузка HTML-кода ведомости по предмету (None — сайт не ответил или отдал страницу без студентов)
+async def fetch_subject_page(object_index):
+
+    # Пока "предохранитель" разомкнут, на сайт не ходим
+    if not site_request_allowed():
+        return None
+
+    url = CONFIG["RATING_URL"].format(object_index)
+    session = await get_site_session()
+
+    try:
+        async with session.get(url, headers={"User-Agent": random.choice(USER_AGENTS)}) as response:
+            response.raise_for_status()
+            html = await response.text()
+    except Exception as e:
+        logger.error(f"Ошибка: {e!r}")
+        record_site_failure()
+        return None
+
+    record_site_success()
+
+    # Страница без строк студентов (ошибка, техработы, пустая ведомость) — загрузка неудачна
+    if not page_has_student_rows(html):
+        logger.warning(f"Ведомость {object_index} загружена без строк студентов — загрузка считается неудачной")
+        return None
+
+    return html
+
+# 1.4. Ожидание слота общего лимита одновременных запросов (False — слот не освободился за LIVE_REQUEST_WAIT).
+# Семафор общий с потоками синхронного кода, поэтому он опрашивается без блокировки цикла событий
+async def acquire_live_request():
+    loop = asyncio.get_running_loop()
+    deadline = loop.time() + CONFIG["LIVE_REQUEST_WAIT"]
+
+    while not live_requests.acquire(blocking=False):
+        if loop.time() >= deadline:
+            return False
+        await asyncio.sleep(0.05)
+    return True
+
+# 1.5. Отправка сообщения с логированием ошибок (как try/except вокруг bot.send_message в синхронном режиме)
+async def safe_send_message(chat_id, text, **kwargs):
+    try:
+        await bot.send_message(chat_id, text, **kwargs)
+    except Exception as e:
+        logger.error(f"Ошибка отправки сообщения: {e}")
+
+
+# 2. ОБРАБОТЧИКИ КОМАНД (повторяют раздел 4 vsuetEG31.py)
+
+# 2.1. Handler = start
+@bot.message_handler(commands=['start'])
+async def start(message):
+    chat_id = message.chat.id
+    update_activity(chat_id)
+
+    markup = types.ReplyKeyboardMarkup(resize_keyboard=True, one_time_keyboard=False)
+    markup.add("Начать")
+    await safe_send_message(
+        chat_id,
+        "Привет! Я бот для мониторинга твоего рейтинга.\n\n"
+        "Нажми на кнопку «Начать» или введи команду с клавиатуры",
+        reply_markup=markup
+    )
+
+# 2.2. Handler для отмены действия
+@bot.message_handler(func=lambda message: message.text in ["Отмена", "Вернуться назад", "вернуться назад", "отмена"])
+async def handle_cancel(message):
+    chat_id = message.chat.id
+
+    cleanup_on_exit(chat_id)
+
+    markup = types.ReplyKeyboardMarkup(resize_keyboard=True, one_time_keyboard=False)
+    markup.add("Начать")
+    await safe_send_message(
+        chat_id,
+        "Действие отменено. Вы в главном меню.",
+        reply_markup=markup
+    )
+
+# 2.3. Handler для запуска в работу бота
+@bot.message_handler(func=lambda message: message.text and message.text.lower() == "начать")
+async def handle_start(message):
+    chat_id = message.chat.id
+    update_activity(chat_id)
+
+    await safe_send_message(
+        chat_id,
+        "Выберите действие:",
+        reply_markup=create_main_menu_markup()
+    )
+
+# 2.4. Handler для ввода номера зачётной книжки
+@bot.message_handler(func=lambda message: message.text and message.text.lower() == "ввести номер зачётной книжки")
+async def handle_choose_subject(message):
+    chat_id = message.chat.id
+    update_activity(chat_id)
+
+    with data_lock:
+        user_state.pop(chat_id, None)
+        user_selected_data.pop(chat_id, None)
+        user_state[chat_id] = "entering_id_first"
+
+    await safe_send_message(
+        chat_id,
+        "Введите номер вашей зачётной книжки (ровно 6 цифр):",
+        reply_markup=create_cancel_markup()
+    )
+
+# 2.5. Handler ввода номера зачётной книжки и подключения уведомлений
+@bot.message_handler(func=lambda message:
+    message.chat.id in user_state and
+    user_state[message.chat.id] == "entering_id_first"
+)
+async def handle_student_id_first(message):
+    chat_id = message.chat.id
+    student_id = (message.text or "").strip()
+
+    if not is_site_available():
+        await safe_send_message(
+            chat_id,
+            "Сайт рейтинга недоступен с 19:00 до 09:00.\n"
+            "Попробуйте запросить данные днём.",
+            reply_markup=create_retry_markup()
+        )
+        return
+
+    update_activity(chat_id)
+
+    if not (student_id.isdigit() and len(student_id) == CONFIG["STUDENT_ID_LENGTH"]):
+        await safe_send_message(
+            chat_id,
+            "Номер зачётной книжки должен содержать ровно 6 цифр.\n"
+            "Повторите ввод:",
+            reply_markup=create_cancel_markup()
+        )
+        return
+
+    if is_unknown_student(student_id):
+        await send_unknown_student_message(chat_id, student_id)
+        return
+
+    allowed, notify = take_request_token(chat_id, cost=count_pages_to_load(student_id))
+    if not allowed:
+        if notify:
+            await safe_send_message(chat_id, "Слишком много запросов. Подождите несколько секунд и повторите.")
+        return
+
+    all_subjects = subscribe_user(chat_id, student_id)
+
+    await safe_send_message(
+        chat_id,
+        "Подключение уведомлений... Ожидайте",
+        reply_markup=types.ReplyKeyboardRemove()
+    )
+
+    pages_loaded = 0
+    pages_failed = 0
+    found_count = 0
+    busy = False
+
+    for subject_name in all_subjects:
+        # Ведомость по этому номеру недавно загружалась — повторный ввод не обращается к сайту
+        result = get_recent_result(student_id, subject_name)
+        if result is not None:
+            pages_loaded += 1
+            if result["data"]:
+                found_count += 1
+                save_previous_rating(chat_id, subject_name, result["data"])
+            continue
+
+        # Слот общего лимита занимается только на загрузку и разбор одной ведомости
+        if not await acquire_live_request():
+            busy = True
+            break
+
+        try:
+            html = await fetch_subject_page(DICT_SUBJECT[subject_name])
+            data = await run_blocking(parse_rating_html, html, student_id) if html is not None else None
+        finally:
+            live_requests.release()
+
+        if html is None:
+            pages_failed += 1
+            if is_site_down():
+                break
+        else:
+            pages_loaded += 1
+            store_recent_result(student_id, subject_name, data)
+
+        if data:
+            found_count += 1
+            save_previous_rating(chat_id, subject_name, data)
+
+        await asyncio.sleep(1)
+
+    if not pages_loaded:
+        unsubscribe_user(chat_id)
+        if busy:
+            text = "Сейчас много запросов. Повторите через несколько секунд."
+        else:
+            text = "Сайт рейтинга сейчас не отвечает.\nПопробуйте ввести номер позже:"
+        await safe_send_message(chat_id, text, reply_markup=create_cancel_markup())
+        return
+
+    if pages_loaded and not pages_failed and not busy and not found_count:
+        mark_unknown_student(student_id)
+        unsubscribe_user(chat_id)
+        await send_unknown_student_message(chat_id, student_id)
+        return
+
+    if found_count:
+        mark_unknown_student(student_id, unknown=False)
+
+    await safe_send_message(
+        chat_id,
+        "Уведомления успешно подключены",
+        reply_markup=types.ReplyKeyboardRemove()
+    )
+
+    with data_lock:
+        user_state[chat_id] = "choosing_subject_after_id"
+
+    await safe_send_message(
+        chat_id,
+        create_subject_menu_text(),
+        reply_markup=create_subject_keyboard()
+    )
+
+# 2.5.1. Сообщение о номере, которого нет ни в одной ведомости
+async def send_unknown_student_message(chat_id, student_id):
+    await safe_send_message(
+        chat_id,
+        f"Студент {student_id} не найден ни в одной ведомости.\n"
+        "Проверьте номер зачётной книжки и повторите ввод:",
+        reply_markup=create_cancel_markup()
+    )
+
+# 2.6. Handler выбора предмета
+@bot.message_handler(
+    func=lambda m: m.text and m.text.isdigit()
+    and m.chat.id in user_state
+    and user_state[m.chat.id] == "choosing_subject_after_id"
+)
+async def handle_subject_choice_after_id(message):
+    chat_id = message.chat.id
+    update_activity(chat_id)
+
+    logger.info(f"{chat_id} выбрал предмет: {message.text}")
+
+    allowed, notify = take_request_token(chat_id)
+    if not allowed:
+        if notify:
+            await bot.send_message(chat_id, "Слишком много запросов. Подождите несколько секунд и повторите.")
+        return
+
+    if not is_site_available():
+        await bot.send_message(
+            chat_id,
+            "Сайт рейтинга недоступен с 19:00 до 09:00.\nПопробуйте днём.",
+            reply_markup=create_retry_markup()
+        )
+        return
+
+    with data_lock:
+        selected = user_selected_data.get(chat_id)
+
+    if not selected:
+        await bot.send_message(
+            chat_id,
+            "Сессия устарела. Нажмите «Начать»",
+            reply_markup=types.ReplyKeyboardMarkup(resize_keyboard=True).add("Начать")
+        )
+        return
+
+    student_id = selected["student_id"]
+    choice = int(message.text)
+
+    if not (1 <= choice <= len(DICT_SUBJECT)):
+        await bot.send_message(chat_id, f"Введите число от 1 до {len(DICT_SUBJECT)}")
+        return
+
+    subject_name = list(DICT_SUBJECT.keys())[choice - 1]
+    object_index = DICT_SUBJECT[subject_name]
+
+    markup = create_retry_markup()
+
+    result = get_recent_result(student_id, subject_name)
+
+    # Нет результата или ведомость загружена при подключении уведомлений, но картинка ещё не отрисована
+    if result is None or (result["data"] and result["image"] is None):
+        # Общее ограничение одновременных загрузок и отрисовок
+        if not await acquire_live_request():
+            await bot.send_message(
+                chat_id,
+                "Сейчас много запросов. Повторите через несколько секунд.",
+                reply_markup=markup
+            )
+            return
+
+        try:
+            if result is None:
+                await bot.send_message(chat_id, "Загружаем данные...")
+
+                html = await fetch_subject_page(object_index)
+                if html is None:
+                    await bot.send_message(
+                        chat_id,
+                        "Сайт рейтинга сейчас не отвечает.\nПопробуйте позже.",
+                        reply_markup=markup
+                    )
+                    return
+
+                data = await run_blocking(parse_rating_html, html, student_id)
+            else:
+                data = result["data"]
+
+            image = await run_blocking(create_rating_image, data, student_id, subject_name) if data else None
+            result = store_recent_result(student_id, subject_name, data, image)
+        finally:
+            live_requests.release()
+
+    if result["image"]:
+        await bot.send_photo(
+            chat_id,
+            BytesIO(result["image"]),
+            caption=f"Рейтинг по предмету: {subject_name}",
+            reply_markup=markup
+        )
+    else:
+        await bot.send_message(
+            chat_id,
+            f"Студент {student_id} не найден.",
+            reply_markup=markup
+        )
+
+# 2.7. Обработчик команды "Выбрать другой предмет"
+@bot.message_handler(func=lambda m: m.text == "Выбрать другой предмет")
+async def handle_choose_again(message):
+    chat_id = message.chat.id
+    update_activity(chat_id)
+
+    await bot.send_message(
+        chat_id,
+        create_subject_menu_text(),
+        reply_markup=create_subject_keyboard()
+    )
+
+
+# 3. ЗАПУСК
+
+# 3.1. Слушатель обновлений: прогрев запускается после первого успешного getUpdates с сообщениями
+async def prewarm_on_first_update(messages):
+    if not prewarm_started.is_set():
+        start_prewarm()
+
+# 3.2. Точка входа
+async def main():
+    await bot.remove_webhook()
+    logger.info("Веб-хук удален")
+
+    # Мониторинг и очистка остаются в фоновых потоках (общие с синхронным режимом)
+    start_background_threads()
+
+    logger.info("=" * 50)
+    logger.info("Бот успешно запущен (асинхронный режим)!")
+    logger.info(f"Интервал мониторинга: {CONFIG['CHECK_INTERVAL']} секунд")
+    logger.info("=" * 50)
+
+    bot.set_update_listener(prewarm_on_first_update)
+
+    try:
+        await bot.infinity_polling(timeout=30, request_timeout=40)
+    finally:
+        if site_session is not None:
+            await site_session.close()
+
+
+if __name__ == "__main__":
+    try:
+        asyncio.run(main())
+    except KeyboardInterrupt:
+        logger.info("Бот остановлен пользователем")
+    except Exception as e:
+        logger.critical(f"Критическая ошибка: {e}", exc_info=True)